@@ -0,0 +1,306 @@
+"""
+Shared helpers for the CosmosDB usage scripts: logging, client options,
+throttling retries and the batched patch pipeline.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.cosmos import exceptions
+from azure.cosmos.partition_key import NonePartitionKeyValue
+
+logger = logging.getLogger(__name__)
+
+# Connection pool configuration
+CONNECTION_POOL_SIZE = 256          # Total open connections
+CONNECTION_POOL_SIZE_PER_HOST = 256 # Open connections per endpoint
+KEEPALIVE_TIMEOUT = 120             # Seconds an idle connection is kept open
+
+# CosmosClient options
+CLIENT_OPTIONS = {
+    # Send every request to the account endpoint (the write region) instead of
+    # discovering regional endpoints first; this is a short-lived write job
+    "enable_endpoint_discovery": False,
+    # None uses the account's default level. On Strong/Bounded Staleness accounts, set the
+    # COSMOS_CONSISTENCY_LEVEL environment variable to Session to avoid the quorum cost; it
+    # is enough for a job that only reads its own writes. The service rejects a level
+    # stronger than the account default, so leave it unset on Eventual/Consistent Prefix
+    "consistency_level": os.environ.get("COSMOS_CONSISTENCY_LEVEL") or None,
+    # The SDK retries throttled (429) requests, failed connections and socket reads up to
+    # retry_total times, waiting at most retry_backoff_max seconds between retries. This
+    # covers every request, including the query pages that with_throttle_retry doesn't wrap
+    "retry_total": 9,
+    "retry_backoff_max": 30,
+    # The Python SDK only talks to the gateway over HTTPS (there is no Direct/TCP mode to
+    # switch to), so give up on a stalled response sooner than the 65s default and let the
+    # read retries above resend it; patches, batches and id-only query pages are all small
+    "read_timeout": 15,
+}
+
+MAX_THROTTLE_RETRIES = 9  # Retries on 429/503 once the SDK has given up
+# RU/s the writes may use, from the WRITE_RU_BUDGET environment variable; None for no limit
+RU_BUDGET_PER_SECOND = float(os.environ.get("WRITE_RU_BUDGET") or 0) or None
+ESTIMATED_PATCH_CHARGE = 10.0  # RUs assumed per patch until real charges have been seen
+PROGRESS_INTERVAL = 1.0  # Seconds between progress messages
+# Batch failures caused by the document itself; anything else is worth resending
+PERMANENT_BATCH_ERRORS = (400, 404, 409, 412)
+
+
+def start_logging(script_logger):
+    """Write log output from a background thread so console I/O never blocks the event loop"""
+    log_queue = queue.Queue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    # The script's own messages and the ones from these shared helpers
+    for target in (script_logger, logger):
+        target.addHandler(QueueHandler(log_queue))
+        target.setLevel(logging.INFO)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+def create_transport():
+    """Build an aiohttp transport with a larger connection pool and longer keep-alive"""
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTION_POOL_SIZE,
+        limit_per_host=CONNECTION_POOL_SIZE_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        # Abort TLS connections the server closed instead of leaving them half-open in the pool
+        enable_cleanup_closed=True
+    )
+    # The transport owns the session, so closing the client also closes it
+    return AioHttpTransport(session=aiohttp.ClientSession(connector=connector))
+
+
+async def with_throttle_retry(operation, *args, on_throttle=None, **kwargs):
+    """Run a CosmosDB operation, waiting and retrying when it is throttled (HTTP 429) or unavailable (HTTP 503)"""
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        try:
+            return await operation(*args, **kwargs)
+        except exceptions.CosmosHttpResponseError as e:
+            if e.status_code not in (429, 503) or attempt == MAX_THROTTLE_RETRIES:
+                raise
+            if e.status_code == 429:
+                # Wait as long as the service asks
+                delay = float(e.headers.get('x-ms-retry-after-ms', 100)) / 1000
+                # Only throttling means the RU/s are exhausted; a 503 is an outage, not a signal to slow down
+                if on_throttle:
+                    on_throttle(delay)
+            else:
+                # Unavailable: back off exponentially, capped like the SDK's own retries
+                delay = min(0.1 * 2 ** attempt, CLIENT_OPTIONS["retry_backoff_max"])
+            # Jitter so workers don't retry in lockstep
+            await asyncio.sleep(delay + random.random() * 0.05)
+
+
+async def get_partition_key_path(container):
+    """Read the container's partition key path, e.g. /userId"""
+    properties = await container.read()
+    paths = properties["partitionKey"]["paths"]
+    if len(paths) != 1:
+        raise ValueError(f"Only single-path partition keys are supported, container has {paths}")
+    return paths[0]
+
+
+def partition_key_projection(partition_key_path):
+    """Query projection returning the partition key value as partitionKey, e.g. c["userId"] AS partitionKey"""
+    segments = partition_key_path.strip("/").split("/")
+    return "c" + "".join(f"[{json.dumps(segment)}]" for segment in segments) + " AS partitionKey"
+
+
+def partition_key_value(item):
+    """Partition key of an item queried with partition_key_projection"""
+    # A document without the field has an undefined key, which is not the same as a null one
+    return item["partitionKey"] if "partitionKey" in item else NonePartitionKeyValue
+
+
+class RequestUnitBudget:
+    """
+    Limits the RUs the writes spend in each one-second window, leaving
+    headroom for the other traffic on the container.
+    """
+
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self.window_start = time.monotonic()
+        self.reserved = 0.0
+        self.total_charge = 0.0
+        self.operations = 0
+
+    async def reserve(self, operation_count):
+        """Wait until the current window has room for the expected charge of the operations"""
+        if not self.per_second:
+            return
+        # Expect the average charge per operation seen so far
+        average_charge = self.total_charge / self.operations if self.operations else ESTIMATED_PATCH_CHARGE
+        expected = operation_count * average_charge
+        while True:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.reserved = 0.0
+            # A request larger than the whole budget still goes out, alone in its window
+            if not self.reserved or self.reserved + expected <= self.per_second:
+                self.reserved += expected
+                return
+            await asyncio.sleep(self.window_start + 1 - now)
+
+    def record(self, request_charge, operation_count):
+        """Add the charge reported for completed operations"""
+        self.total_charge += request_charge
+        self.operations += operation_count
+
+
+class BatchStats:
+    """Counts kept by patch_in_batches"""
+
+    def __init__(self):
+        self.found = 0
+        self.written = 0
+        self.skipped = 0  # Documents the service rejected
+        self.failed = 0   # Documents in batches that still failed after all retries
+        self.request_charge = 0.0
+
+
+async def patch_in_batches(container, condition, parameters, patch_operations, max_records,
+                           batch_size=100, concurrency=10, queue_size=20, max_pending=500,
+                           progress_label="Patched"):
+    """
+    Apply the same patch operations to every document matching the WHERE condition, in
+    transactional batches grouped by partition key.
+    """
+    # Only the id and partition key are needed to patch a document
+    partition_key_path = await get_partition_key_path(container)
+    query = f"SELECT c.id, {partition_key_projection(partition_key_path)} FROM c WHERE {condition}"
+
+    # Batches flow from the query straight to the writers so saving starts with the first page
+    batch_queue = asyncio.Queue(maxsize=queue_size)
+    stats = BatchStats()
+    ru_budget = RequestUnitBudget(RU_BUDGET_PER_SECOND)
+
+    async def producer():
+        # Bulk-style writes: group the documents by partition key into transactional batches
+        pending = defaultdict(list)
+        pending_count = 0
+
+        async def send(partition_key):
+            nonlocal pending_count
+            docs = pending.pop(partition_key)
+            pending_count -= len(docs)
+            await batch_queue.put((partition_key, docs))
+
+        async def query_range(feed_range):
+            nonlocal pending_count
+            # Scoped to one physical partition, so the service doesn't fan the query out
+            async for item in container.query_items(
+                query=query,
+                parameters=parameters,
+                feed_range=feed_range,
+                max_item_count=-1,
+                populate_query_metrics=False
+            ):
+                if stats.found >= max_records:
+                    break
+                partition_key = partition_key_value(item)
+                pending[partition_key].append(item)
+                pending_count += 1
+                stats.found += 1
+                if len(pending[partition_key]) >= batch_size:
+                    await send(partition_key)
+                elif pending_count >= max_pending:
+                    # Many partially filled batches: send the largest so the writers stay busy
+                    await send(max(pending, key=lambda key: len(pending[key])))
+
+        try:
+            # Query every physical partition in parallel
+            feed_ranges = [feed_range async for feed_range in container.read_feed_ranges()]
+            await asyncio.gather(*(query_range(feed_range) for feed_range in feed_ranges))
+
+            # Flush the partially filled batches
+            for partition_key, docs in pending.items():
+                await batch_queue.put((partition_key, docs))
+        finally:
+            for _ in range(concurrency):
+                await batch_queue.put(None)
+
+    async def consumer():
+        while True:
+            batch = await batch_queue.get()
+            if batch is None:
+                break
+            partition_key, docs = batch
+            attempt = 0
+
+            while docs:
+                # Patch only the changed fields; no need to read or resend the whole documents
+                operations = [("patch", (doc['id'], patch_operations)) for doc in docs]
+
+                # Stay within this second's RU budget
+                await ru_budget.reserve(len(operations))
+                request_charges = []
+
+                try:
+                    await with_throttle_retry(
+                        container.execute_item_batch,
+                        operations,
+                        partition_key=partition_key,
+                        response_hook=lambda headers, _: request_charges.append(
+                            float(headers.get('x-ms-request-charge', 0))
+                        )
+                    )
+                    ru_budget.record(sum(request_charges), len(operations))
+                    stats.written += len(docs)
+                except exceptions.CosmosBatchOperationError as e:
+                    # One failed patch rolls back the whole batch. status_code is the failing
+                    # operation's status, or 0 when every operation only reports 424
+                    if e.status_code in PERMANENT_BATCH_ERRORS:
+                        # The document itself can't be patched: skip it and resend the rest
+                        failed_id = docs[e.error_index].get('id')
+                        logger.error(f"❌ Skipping document {failed_id} in partition {partition_key}: {e}")
+                        stats.skipped += 1
+                        docs = docs[:e.error_index] + docs[e.error_index + 1:]
+                        continue
+                    if attempt < MAX_THROTTLE_RETRIES:
+                        # Throttled, timed out, conflicting write or unavailable: resend the whole batch
+                        await asyncio.sleep(min(0.1 * 2 ** attempt, CLIENT_OPTIONS["retry_backoff_max"])
+                                            + random.random() * 0.05)
+                        attempt += 1
+                        continue
+                    logger.error(f"❌ Error updating batch for partition {partition_key}: {e}")
+                    stats.failed += len(docs)
+                except Exception as e:
+                    logger.error(f"❌ Error updating batch for partition {partition_key}: {e}")
+                    stats.failed += len(docs)
+                break
+
+    async def report_progress():
+        # Writers only bump a counter; one task logs it at a steady rate
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            logger.info(f"✅ {progress_label} {stats.written} documents...")
+
+    progress_task = asyncio.ensure_future(report_progress())
+    try:
+        # If the query fails, still let the writers finish the batches already queued so the
+        # caller doesn't close the client under them; the error is raised once they are done
+        results = await asyncio.gather(
+            producer(), *[consumer() for _ in range(concurrency)], return_exceptions=True
+        )
+    finally:
+        progress_task.cancel()
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    stats.request_charge = ru_budget.total_charge
+    return stats
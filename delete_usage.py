@@ -3,7 +3,11 @@ Delete usage field from 1000 CosmosDB records
 """
 
 import asyncio
+import logging
 from azure.cosmos.aio import CosmosClient
+from cosmos_common import CLIENT_OPTIONS, create_transport, patch_in_batches, start_logging
+
+logger = logging.getLogger(__name__)
 
 # CosmosDB Configuration
 ENDPOINT = "https://your-account.documents.azure.com:443/"
@@ -12,48 +16,50 @@ DATABASE_NAME = "chathistory"
 CONTAINER_NAME = "messages"
 
 MAX_RECORDS = 1000
+BATCH_SIZE = 100    # Operations per transactional batch (Cosmos DB allows at most 100)
+CONCURRENCY = 10    # Batches in flight at once
+QUEUE_SIZE = 20     # Batches buffered between the query and the writers
+MAX_PENDING = 500   # Queried documents held while waiting for their partition's batch to fill
+
+REMOVE_USAGE_OPERATIONS = [{"op": "remove", "path": "/usage"}]
+
 
 async def main():
-    client = CosmosClient(ENDPOINT, credential=KEY)
+    client = CosmosClient(ENDPOINT, credential=KEY, transport=create_transport(), **CLIENT_OPTIONS)
     database = client.get_database_client(DATABASE_NAME)
     container = database.get_container_client(CONTAINER_NAME)
-    
+
     try:
-        # Query for documents with usage field
-        query = "SELECT * FROM c WHERE IS_DEFINED(c.usage)"
-        
-        print(f"🔍 Querying for up to {MAX_RECORDS} documents with usage field...")
-        documents = []
-        
-        async for item in container.query_items(query=query, max_item_count=10):
-            documents.append(item)
-            if len(documents) >= MAX_RECORDS:
-                break
-        
-        print(f"📋 Found {len(documents)} documents\n")
-        
-        # Delete usage field from each document
-        deleted_count = 0
-        for i, doc in enumerate(documents, 1):
-            try:
-                # Remove the usage field
-                if 'usage' in doc:
-                    del doc['usage']
-                
-                # Save document back
-                await container.upsert_item(doc)
-                deleted_count += 1
-                
-                if i % 10 == 0:
-                    print(f"✅ Processed {i}/{len(documents)} documents...")
-                    
-            except Exception as e:
-                print(f"❌ Error updating document {doc.get('id')}: {e}")
-        
-        print(f"\n🎉 Complete! Deleted usage field from {deleted_count} documents")
-        
+        # Documents with usage field
+        condition = "IS_DEFINED(c.usage)"
+
+        logger.info(f"🔍 Querying for up to {MAX_RECORDS} documents with usage field...\n")
+
+        stats = await patch_in_batches(
+            container,
+            condition,
+            None,
+            REMOVE_USAGE_OPERATIONS,
+            MAX_RECORDS,
+            batch_size=BATCH_SIZE,
+            concurrency=CONCURRENCY,
+            queue_size=QUEUE_SIZE,
+            max_pending=MAX_PENDING,
+            progress_label="Deleted usage field from"
+        )
+
+        logger.info(f"\n📋 Found {stats.found} documents")
+        logger.info(f"🎉 Complete! Deleted usage field from {stats.written} documents")
+        logger.info(f"⚠️  Skipped: {stats.skipped} documents, failed: {stats.failed} documents")
+        logger.info(f"💰 Request units consumed: {stats.request_charge:.2f}")
+
     finally:
         await client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    log_listener = start_logging(logger)
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
+
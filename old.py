@@ -38,17 +38,24 @@ Environment Variable Setup Examples:
 """
 
 import asyncio
+import logging
 import os
 import sys
+import time
 from datetime import datetime, timezone
+from azure.core import MatchConditions
 from azure.cosmos.aio import CosmosClient
 from azure.cosmos import exceptions
 from azure.identity import DefaultAzureCredential
+from cosmos_common import (CLIENT_OPTIONS, create_transport, get_partition_key_path, partition_key_projection,
+                           partition_key_value, start_logging, with_throttle_retry)
+
+logger = logging.getLogger(__name__)
 
 
 def _utc_now():
     """Generate current UTC timestamp in ISO format"""
-    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
 
 # ===================================================================
@@ -60,14 +67,84 @@ COSMOSDB_CONTAINER = "conversations"
 
 UPDATED_BY = "121"
 
+# Usage subfields, and the value written to documents missing the usage field (shared, never mutated)
+USAGE_FIELDS = ('completion_tokens', 'prompt_tokens', 'total_tokens')
+USAGE_NULL = dict.fromkeys(USAGE_FIELDS)
+
+# Adaptive write concurrency: grows while under the RU/s target, halves when throttled
+INITIAL_CONCURRENCY = 10
+MAX_CONCURRENCY = 100
+RU_TARGET_FRACTION = 0.8  # Share of the container's provisioned RU/s to aim for
+THROTTLE_BACKOFF_SECONDS = 1.0  # Minimum time between two halvings of the limit
+
+# Maximum continuation token size in KB when falling back to paged queries
+CONTINUATION_TOKEN_LIMIT_KB = 4
+
 # ===================================================================
 # COMMON COSMOS DB SETUP (reusable for other scripts)
 # ===================================================================
 
+class AdaptiveConcurrency:
+    """
+    Limits the requests in flight. The limit grows by one while
+    the estimated RU/s stays under the target and halves when a request is throttled.
+    """
+    
+    def __init__(self, initial, ru_budget=None, maximum=MAX_CONCURRENCY):
+        self.limit = initial
+        self.ru_budget = ru_budget
+        self.maximum = maximum
+        self.inflight = 0
+        self.backoff_until = 0.0
+        self._condition = asyncio.Condition()
+    
+    async def acquire(self):
+        """Wait until another request may start"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.inflight < self.limit)
+            self.inflight += 1
+    
+    async def release(self):
+        """Mark a request as finished"""
+        async with self._condition:
+            self.inflight -= 1
+            self._condition.notify_all()
+    
+    def record_success(self, request_charge, elapsed):
+        """Allow one more request in flight if there is RU/s headroom"""
+        if self.limit >= self.maximum:
+            return
+        if self.ru_budget:
+            estimated_ru_per_second = request_charge * self.inflight / max(elapsed, 0.001)
+            if estimated_ru_per_second >= self.ru_budget * RU_TARGET_FRACTION:
+                return
+        self.limit += 1
+    
+    def record_throttle(self, retry_after=0.0):
+        """Halve the limit after a 429 response, at most once per back-off window"""
+        now = time.monotonic()
+        # Requests in flight are usually throttled together; one burst is one signal
+        if now < self.backoff_until:
+            return
+        self.limit = max(1, self.limit // 2)
+        self.backoff_until = now + max(retry_after, THROTTLE_BACKOFF_SECONDS)
+
+
+async def get_provisioned_throughput(container):
+    """Return the container's provisioned RU/s, or None if it cannot be read"""
+    try:
+        throughput = await container.get_throughput()
+    except exceptions.CosmosHttpResponseError:
+        # Serverless accounts and shared database throughput have no container offer
+        logger.warning("⚠️  Could not read container throughput - concurrency will only back off when throttled")
+        return None
+    return throughput.auto_scale_max_throughput or throughput.offer_throughput
+
+
 async def create_cosmos_client(endpoint, credential, database_name, container_name):
     """Initialize and validate CosmosDB client connection"""
     try:
-        client = CosmosClient(endpoint, credential=credential)
+        client = CosmosClient(endpoint, credential=credential, transport=create_transport(), **CLIENT_OPTIONS)
         database = client.get_database_client(database_name)
         container = database.get_container_client(container_name)
         
@@ -75,9 +152,9 @@ async def create_cosmos_client(endpoint, credential, database_name, container_na
         await database.read()
         await container.read()
         
-        print(f"✅ Connected to CosmosDB: {endpoint}")
-        print(f"🗃️  Database: {database_name}")
-        print(f"📦 Container: {container_name}")
+        logger.info(f"✅ Connected to CosmosDB: {endpoint}")
+        logger.info(f"🗃️  Database: {database_name}")
+        logger.info(f"📦 Container: {container_name}")
         
         return client, container
     
@@ -95,23 +172,23 @@ def validate_environment():
     # Check environment variable for endpoint
     endpoint = os.getenv("COSMOSDB_ENDPOINT")
     if not endpoint or endpoint.strip() == "":
-        print("❌ COSMOSDB_ENDPOINT environment variable is empty - please set it")
+        logger.error("❌ COSMOSDB_ENDPOINT environment variable is empty - please set it")
         return False
     
     # Check global configuration variables
     if not COSMOSDB_DATABASE or COSMOSDB_DATABASE.strip() == "":
-        print("❌ COSMOSDB_DATABASE is empty - please update in the script")
+        logger.error("❌ COSMOSDB_DATABASE is empty - please update in the script")
         return False
     
     if not COSMOSDB_CONTAINER or COSMOSDB_CONTAINER.strip() == "":
-        print("❌ COSMOSDB_CONTAINER is empty - please update in the script")
+        logger.error("❌ COSMOSDB_CONTAINER is empty - please update in the script")
         return False
     
     if not UPDATED_BY or UPDATED_BY.strip() == "":
-        print("❌ UPDATED_BY is empty - please update in the script")
+        logger.error("❌ UPDATED_BY is empty - please update in the script")
         return False
     
-    print("✅ Configuration validated")
+    logger.info("✅ Configuration validated")
     return True
 
 
@@ -124,42 +201,55 @@ def get_configuration():
     
     if cosmosdb_key:
         credential = cosmosdb_key
-        print("🔑 Using CosmosDB key for authentication")
+        logger.info("🔑 Using CosmosDB key for authentication")
     else:
         credential = DefaultAzureCredential()
-        print("🔑 Using DefaultAzureCredential for authentication")
+        logger.info("🔑 Using DefaultAzureCredential for authentication")
     
     return endpoint, credential, database_name, container_name
 
 
-async def process_in_batches(documents, process_func, batch_size=50, concurrency=10):
-    """Process documents in batches with controlled concurrency"""
+async def process_documents(documents, process_func, report_every=50, concurrency=10, limiter=None):
+    """Process a stream of documents with controlled concurrency"""
     updated_count = 0
     error_count = 0
     
-    for i in range(0, len(documents), batch_size):
-        batch = documents[i:i + batch_size]
-        print(f"📦 Processing batch {i//batch_size + 1}/{(len(documents) + batch_size - 1)//batch_size}")
-        
-        semaphore = asyncio.Semaphore(concurrency)
-        
-        async def process_with_semaphore(doc):
-            async with semaphore:
-                return await process_func(doc)
-        
-        tasks = [process_with_semaphore(doc) for doc in batch]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+    if limiter is None:
+        limiter = AdaptiveConcurrency(concurrency)
+    
+    async def process_one(doc):
+        nonlocal updated_count, error_count
+        try:
+            result = await process_func(doc)
+        except Exception:
+            result = False
+        finally:
+            await limiter.release()
         
         # Count results
-        for result in results:
-            if isinstance(result, Exception):
-                error_count += 1
-            elif result:
-                updated_count += 1
-            else:
-                error_count += 1
+        if result:
+            updated_count += 1
+        else:
+            error_count += 1
         
-        print(f"✅ Batch completed. Updated so far: {updated_count}")
+        if (updated_count + error_count) % report_every == 0:
+            logger.info(f"✅ Processed {updated_count + error_count} documents. Updated so far: {updated_count} "
+                  f"(concurrency: {limiter.limit})")
+    
+    # A new document starts as soon as any request finishes, with no barrier between
+    # groups of documents; only the documents in flight are held in memory
+    tasks = set()
+    try:
+        async for doc in documents:
+            await limiter.acquire()
+            task = asyncio.ensure_future(process_one(doc))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        # Even if the query fails, let the patches already started finish before the
+        # error reaches the caller and the client is closed
+        if tasks:
+            await asyncio.gather(*tasks)
     
     return updated_count, error_count
 
@@ -168,75 +258,44 @@ async def process_in_batches(documents, process_func, batch_size=50, concurrency
 # SPECIFIC LOGIC FOR ADDING USAGE FIELDS (customize for other tasks)
 # ===================================================================
 
-async def query_documents_with_count_pagination(container, base_query):
+async def query_documents_by_page(container, base_query, parameters=None):
     """
-    Query documents using count-based pagination with OFFSET/LIMIT
+    Yield documents page by page using continuation tokens
     """
-    print("🔄 Using count-based pagination approach...")
-    
-    all_documents = []
-    page_size = 1000  # Start with reasonable page size
+    document_count = 0
     page_count = 0
-    offset = 0
     
-    try:
-        # Add ORDER BY to ensure consistent pagination
-        ordered_query = base_query + " ORDER BY c.id"
-        
-        while True:
-            page_count += 1
-            print(f"📦 Processing page {page_count} (offset: {offset}, page size: {page_size})")
-            
-            # Create paginated query using OFFSET and LIMIT
-            paginated_query = f"{ordered_query} OFFSET {offset} LIMIT {page_size}"
-            
-            page_docs = []
-            
-            try:
-                async for item in container.query_items(query=paginated_query, 
-                parameters=[dict(name="@continuation_token_limit", value="4096")]):
-                    page_docs.append(item)
-                
-                if not page_docs:
-                    print("✅ No more documents to process")
-                    break
-                    
-                print(f"   📄 Retrieved {len(page_docs)} documents")
-                all_documents.extend(page_docs)
-                
-                # Move to next page
-                offset += len(page_docs)
-                
-                # If we got fewer documents than page_size, we're at the end
-                if len(page_docs) < page_size:
-                    print("✅ Reached end of results")
-                    break
-                    
-            except Exception as e:
-                print(f"Exception: {e}")
-                if "Header value is too long" in str(e):
-                    if page_size > 100:
-                        # Reduce page size and restart pagination from beginning
-                        page_size = max(100, page_size // 2)
-                        page_count = 0
-                        offset = 0
-                        all_documents = []  # Clear any partial results
-                        print(f"   ⚠️  Page too large, reducing to {page_size} documents per page and restarting")
-                        continue
-                    else:
-                        # Skip this problematic offset range and continue
-                        print(f"   ❌ Skipping problematic offset {offset}, moving to next range")
-                        offset += page_size  # Move to next offset range
-                        continue
-                else:
-                    raise e
+    # Let the service pick the page size; the projection and the continuation token
+    # cap keep the response headers small
+    pages = container.query_items(
+        query=base_query,
+        parameters=parameters,
+        max_item_count=-1,
+        continuation_token_limit=CONTINUATION_TOKEN_LIMIT_KB,
+        populate_query_metrics=False
+    ).by_page()
+    
+    async for page in pages:
+        page_count += 1
+        page_document_count = 0
         
-        print(f"✅ Retrieved {len(all_documents)} total documents using count-based pagination")
-        return all_documents
+        # Hand each document on as soon as it is read instead of collecting the page first
+        async for item in page:
+            page_document_count += 1
+            document_count += 1
+            yield item
         
-    except Exception as e:
-        print(f"❌ Count-based pagination failed: {e}")
-        return []
+        logger.info(f"📦 Page {page_count}: retrieved {page_document_count} documents")
+    
+    logger.info("✅ Reached end of results")
+    logger.info(f"✅ Retrieved {document_count} total documents")
+
+
+async def count_documents(container, query, parameters=None):
+    """Count matching documents with a server-side aggregate query"""
+    async for count in container.query_items(query=query, parameters=parameters):
+        return count
+    return 0
 
 
 async def run_update(container, dry_run=True, revert=False):
@@ -248,170 +307,258 @@ async def run_update(container, dry_run=True, revert=False):
         update_name = "Remove Usage Fields from Message Documents"
     else:
         update_name = "Add Usage Fields to Message Documents"
-    query = "SELECT * FROM c WHERE c.type = 'message' and c.role = 'assistant'"
+    # Project only what patching needs instead of whole documents; a dry run also
+    # fetches the few fields it displays
+    fields = ['id', '_etag']
+    if dry_run:
+        fields += ['userId', 'conversationId', 'role', 'createdAt']
+    projection = ", ".join(f"c.{field}" for field in fields)
+    # The partition key path comes from the container itself
+    projection += ", " + partition_key_projection(await get_partition_key_path(container))
+    if dry_run:
+        projection += ", IS_DEFINED(c.usage) AS hasUsage"
+    condition = "c.type = @type AND c.role = @role"
+    # Values are passed as parameters so the service can reuse one compiled query plan
+    parameters = [
+        {'name': '@type', 'value': 'message'},
+        {'name': '@role', 'value': 'assistant'}
+    ]
     
-    print(f"🔍 Querying for documents: {update_name}")
-    print(f"📋 Query: {query}")
+    # Skipped documents are never returned, so count all candidates with one aggregate query
+    total_count = await count_documents(
+        container,
+        f"SELECT VALUE COUNT(1) FROM c WHERE {condition}",
+        list(parameters)
+    )
     
-    # Try the original approach first
-    all_msg_documents = []
-    try:
-        async for item in container.query_items(query=query, max_item_count=1000):
-            all_msg_documents.append(item)
-        
-        print(f"📊 Found {len(all_msg_documents)} message documents")
-        
-    except Exception as e:
-        error_msg = str(e)
-        if "Header value is too long" in error_msg or "LineTooLong" in error_msg:
-            print(f"⚠️  Standard query failed due to header size limits. Falling back to time-based pagination...")
-            all_msg_documents = await query_documents_with_count_pagination(container, query)
-            
-            if not all_msg_documents:
-                print("❌ Time-based pagination also failed. Dataset may be too large.")
-                return
-            
-            print(f"📊 Found {len(all_msg_documents)} message documents via pagination")
-        else:
-            raise e
+    # FILTER LOGIC - Only return the documents that need updating
+    # Change this condition for different updates
+    if revert:
+        # For revert: only process documents that have usage field AND were updated by this script
+        condition += " AND IS_DEFINED(c.usage) AND c.updatedBy = @updatedBy"
+        parameters.append({'name': '@updatedBy', 'value': UPDATED_BY})
+    else:
+        # Documents that need the usage field added
+        condition += " AND NOT IS_DEFINED(c.usage)"
+    query = f"SELECT {projection} FROM c WHERE {condition}"
     
-    # FILTER LOGIC - Determine which documents need updating
-    documents_to_update = []
-    for doc in all_msg_documents:
-        # Change this condition for different updates
+    def still_needs_update(doc):
+        """Same condition as the query filter, for a document re-read after a conflict"""
         if revert:
-            # For revert: only process documents that have usage field AND were updated by this script
-            if 'usage' in doc and doc.get('updatedBy') == UPDATED_BY:
-                documents_to_update.append(doc)
+            return 'usage' in doc and doc.get('updatedBy') == UPDATED_BY
+        return 'usage' not in doc
+    
+    logger.info(f"🔍 Querying for documents: {update_name}")
+    logger.info(f"📋 Query: {query}")
+    
+    # Documents are processed as the query returns them instead of being collected first
+    to_update_count = 0
+    
+    async def doc_stream():
+        nonlocal to_update_count
+        async for doc in query_documents_by_page(container, query, parameters):
+            to_update_count += 1
+            yield doc
+    
+    def report_documents_to_update():
+        """Print the query results; returns False when there is nothing to do"""
+        skipped_count = total_count - to_update_count
+        logger.info(f"📊 Found {total_count} message documents")
+        if revert:
+            logger.info(f"📋 Documents needing revert (updated by {UPDATED_BY}): {to_update_count}")
+            logger.info(f"📋 Documents skipped (not updated by {UPDATED_BY} or already reverted): {skipped_count}")
+            
+            if not to_update_count:
+                logger.info(f"✅ No documents found that were updated by {UPDATED_BY} and need reverting!")
+                return False
         else:
-            if 'usage' not in doc:  # Documents that need the usage field added
-                documents_to_update.append(doc)
+            logger.info(f"📋 Documents needing updates: {to_update_count}")
+            logger.info(f"📋 Documents already updated: {skipped_count}")
+            
+            if not to_update_count:
+                logger.info(f"✅ All documents have already been updated!")
+                return False
+        return True
     
-    skipped_count = len(all_msg_documents) - len(documents_to_update)
-    if revert:
-        print(f"📋 Documents needing revert (updated by {UPDATED_BY}): {len(documents_to_update)}")
-        print(f"📋 Documents skipped (not updated by {UPDATED_BY} or already reverted): {skipped_count}")
+    if dry_run:
+        # Count the matches on the server and fetch only the examples that will be displayed
+        to_update_count = await count_documents(
+            container,
+            f"SELECT VALUE COUNT(1) FROM c WHERE {condition}",
+            parameters
+        )
+        examples = [doc async for doc in container.query_items(
+            query=f"SELECT TOP 3 {projection} FROM c WHERE {condition}",
+            parameters=parameters
+        )]
         
-        if not documents_to_update:
-            print(f"✅ No documents found that were updated by {UPDATED_BY} and need reverting!")
+        if not report_documents_to_update():
             return
-    else:
-        print(f"📋 Documents needing updates: {len(documents_to_update)}")
-        print(f"📋 Documents already updated: {skipped_count}")
         
-        if not documents_to_update:
-            print(f"✅ All documents have already been updated!")
-            return
-    
-    if dry_run:
         # DRY RUN DISPLAY - Show examples of what would be changed
-        print(f"\n🔍 DRY RUN MODE - No changes will be made")
+        logger.info(f"\n🔍 DRY RUN MODE - No changes will be made")
         if revert:
-            print(f"\nExample documents that would be reverted:")
+            logger.info(f"\nExample documents that would be reverted:")
         else:
-            print(f"\nExample documents that would be updated:")
+            logger.info(f"\nExample documents that would be updated:")
         
-        for i, doc in enumerate(documents_to_update[:3]):
-            print(f"\nDocument {i + 1}:")
-            print(f"  ID: {doc.get('id', 'unknown')}")
-            print(f"  User ID: {doc.get('userId', 'unknown')}")
-            print(f"  Conversation ID: {doc.get('conversationId', 'unknown')}")
-            print(f"  Role: {doc.get('role', 'unknown')}")
-            print(f"  Created At: {doc.get('createdAt', 'unknown')}")
-            print(f"  Has usage field: {'usage' in doc}")
+        for i, doc in enumerate(examples):
+            logger.info(f"\nDocument {i + 1}:")
+            logger.info(f"  ID: {doc.get('id', 'unknown')}")
+            logger.info(f"  User ID: {doc.get('userId', 'unknown')}")
+            logger.info(f"  Conversation ID: {doc.get('conversationId', 'unknown')}")
+            logger.info(f"  Role: {doc.get('role', 'unknown')}")
+            logger.info(f"  Created At: {doc.get('createdAt', 'unknown')}")
+            logger.info(f"  Has usage field: {doc.get('hasUsage')}")
         
-        if len(documents_to_update) > 3:
-            print(f"\n  ... and {len(documents_to_update) - 3} more documents")
+        if to_update_count > 3:
+            logger.info(f"\n  ... and {to_update_count - 3} more documents")
         
         return
     
     else:
-        # ACTUAL UPDATE - Perform the data updates
+        # ACTUAL UPDATE - Perform the data updates as documents are found
+        if revert:
+            logger.info(f"\n🚀 REVERTING documents...")
+        else:
+            logger.info(f"\n🚀 UPDATING documents...")
+        
+        # All documents in this run share one update timestamp
+        updated_at = _utc_now()
+        
+        # UPDATE LOGIC - Change this for different updates
+        # Patch operations only send the changed fields instead of the whole document, and
+        # are the same for every document, so they are built once per run
         if revert:
-            print(f"\n🚀 REVERTING {len(documents_to_update)} documents...")
+            patch_operations = [
+                # Remove the usage field (the query only returns documents updated by this script)
+                {'op': 'remove', 'path': '/usage'},
+                # Update the updated info
+                {'op': 'set', 'path': '/updatedAt', 'value': updated_at},
+                {'op': 'set', 'path': '/updatedBy', 'value': -1}
+            ]
         else:
-            print(f"\n🚀 UPDATING {len(documents_to_update)} documents...")
+            patch_operations = [
+                # Add the usage field with null values
+                {'op': 'add', 'path': '/usage', 'value': USAGE_NULL},
+                # Update the updated info
+                {'op': 'set', 'path': '/updatedAt', 'value': updated_at},
+                {'op': 'set', 'path': '/updatedBy', 'value': UPDATED_BY}
+            ]
+        
+        # Write concurrency adapts to the RU/s headroom of the container
+        limiter = AdaptiveConcurrency(INITIAL_CONCURRENCY, ru_budget=await get_provisioned_throughput(container))
+        
+        # Bound once instead of looked up for every document
+        patch_item = container.patch_item
+        record_throttle = limiter.record_throttle
+        record_success = limiter.record_success
+        
+        total_request_charge = 0.0
         
         async def update_single_document(doc):
             """Update a single document - customize this logic"""
+            nonlocal total_request_charge
             try:
-                # UPDATE LOGIC - Change this for different updates
-                if revert:
-                    # Remove the usage field only if it was added by this script
-                    if 'usage' in doc and doc.get('updatedBy') == UPDATED_BY:
-                        del doc['usage']
-                    # Update the updated info
-                    doc['updatedAt'] = _utc_now()
-                    doc['updatedBy'] = -1
-                else:
-                    # Add the usage field with null values
-                    doc['usage'] = {
-                        'completion_tokens': None,
-                        'prompt_tokens': None,
-                        'total_tokens': None
-                    }
-                    # Update the updated info
-                    doc['updatedAt'] = _utc_now()
-                    doc['updatedBy'] = UPDATED_BY
-                
-                # Save the document back to CosmosDB
-                result = await container.upsert_item(doc)
-                return bool(result)
+                # Apply the changes in CosmosDB, recording the RU charge for the limiter.
+                # The etag makes the patch fail instead of overwriting a concurrent change.
+                etag = doc.get('_etag')
+                for attempt in range(2):
+                    request_charges = []
+                    started = time.monotonic()
+                    
+                    def on_response(headers, _):
+                        request_charges.append(float(headers.get('x-ms-request-charge', 0)))
+                        # The SDK retries 429s itself; the limiter still needs to hear about them
+                        if int(headers.get('x-ms-throttle-retry-count') or 0) > 0:
+                            record_throttle(float(headers.get('x-ms-throttle-retry-wait-time-ms') or 0) / 1000)
+                    
+                    try:
+                        result = await with_throttle_retry(
+                            patch_item,
+                            item=doc['id'],
+                            partition_key=partition_key_value(doc),
+                            patch_operations=patch_operations,
+                            etag=etag,
+                            match_condition=MatchConditions.IfNotModified,
+                            on_throttle=record_throttle,
+                            response_hook=on_response
+                        )
+                        total_request_charge += sum(request_charges)
+                        record_success(sum(request_charges), time.monotonic() - started)
+                        return bool(result)
+                    except exceptions.CosmosAccessConditionFailedError:
+                        # Modified since it was queried - retry once if it still needs the update
+                        current = await container.read_item(item=doc['id'], partition_key=partition_key_value(doc))
+                        if attempt or not still_needs_update(current):
+                            logger.info(f"⏭️  Document {doc['id']} was modified concurrently - skipped")
+                            return False
+                        etag = current['_etag']
                 
             except Exception as e:
                 action = "reverting" if revert else "updating"
-                print(f"❌ Error {action} document {doc.get('id', 'unknown')}: {e}")
+                logger.error(f"❌ Error {action} document {doc.get('id', 'unknown')}: {e}")
                 return False
         
-        # SPOT CHECK - Sample a few records before updating for verification
-        spot_check_sample = documents_to_update[:min(5, len(documents_to_update))]
+        # SPOT CHECK - Sample the first few records before updating for verification
         spot_check_before = {}
+        logger.info(f"\n🔍 SPOT CHECK - Saving up to 5 sample records before update...")
         
-        print(f"\n🔍 SPOT CHECK - Saving {len(spot_check_sample)} sample records before update...")
-        for doc in spot_check_sample:
-            # Create a deep copy of the document for comparison
-            spot_check_before[doc['id']] = {
-                'id': doc.get('id'),
-                'type': doc.get('type'),
-                'userId': doc.get('userId'),
-                'createdAt': doc.get('createdAt'),
-                'updatedAt': doc.get('updatedAt'),
-                'conversationId': doc.get('conversationId'),
-                'role': doc.get('role'),
-                'content': doc.get('content'),
-                'feedback': doc.get('feedback'),
-                'updatedBy': doc.get('updatedBy'),
-                'usage_value': doc.get('usage') if 'usage' in doc else None
-            }
+        async def docs_with_spot_check():
+            async for sample in doc_stream():
+                if len(spot_check_before) < 5:
+                    # The query only projects a few fields, so point-read the full sample document
+                    doc = await container.read_item(item=sample['id'], partition_key=partition_key_value(sample))
+                    # Create a deep copy of the document for comparison
+                    spot_check_before[doc['id']] = {
+                        'id': doc.get('id'),
+                        'partition_key': partition_key_value(sample),
+                        'type': doc.get('type'),
+                        'userId': doc.get('userId'),
+                        'createdAt': doc.get('createdAt'),
+                        'updatedAt': doc.get('updatedAt'),
+                        'conversationId': doc.get('conversationId'),
+                        'role': doc.get('role'),
+                        'content': doc.get('content'),
+                        'feedback': doc.get('feedback'),
+                        'updatedBy': doc.get('updatedBy'),
+                        'usage_value': doc.get('usage')
+                    }
+                yield sample
         
-        # Process documents in batches
-        updated_count, error_count = await process_in_batches(
-            documents_to_update, 
-            update_single_document
+        # Process documents as they stream in
+        updated_count, error_count = await process_documents(
+            docs_with_spot_check(), 
+            update_single_document,
+            limiter=limiter
         )
         
+        if not report_documents_to_update():
+            return
+        skipped_count = total_count - to_update_count
+        
         # SPOT CHECK VERIFICATION - Compare before and after
-        print(f"\n🔍 SPOT CHECK VERIFICATION - Retrieving updated records...")
+        logger.info(f"\n🔍 SPOT CHECK VERIFICATION - Retrieving updated records...")
         spot_check_passed = True
         
-        for doc_id in spot_check_before.keys():
+        # Retrieve the updated documents with concurrent point reads
+        updated_docs = await asyncio.gather(*[
+            container.read_item(item=doc_id, partition_key=before['partition_key'])
+            for doc_id, before in spot_check_before.items()
+        ], return_exceptions=True)
+        
+        for (doc_id, before), updated_doc in zip(spot_check_before.items(), updated_docs):
             try:
-                # Retrieve the updated document using query (no partition key needed)
-                query = f"SELECT * FROM c WHERE c.id = '{doc_id}'"                items = []
-                async for item in container.query_items(query=query, max_item_count=1):
-                    items.append(item)
-                
-                if not items:
-                    print(f"   ❌ ERROR: Document {doc_id} not found after update")
+                if isinstance(updated_doc, exceptions.CosmosResourceNotFoundError):
+                    logger.error(f"   ❌ ERROR: Document {doc_id} not found after update")
                     spot_check_passed = False
                     continue
+                if isinstance(updated_doc, Exception):
+                    raise updated_doc
                 
-                updated_doc = items[0]
-                before = spot_check_before[doc_id]
-                
-                print(f"\n📋 Spot Check for Document ID: {doc_id}")
-                print(f"   Before - Usage field present: {before['usage_value'] is not None}")
-                print(f"   After  - Usage field present: {'usage' in updated_doc}")
+                logger.info(f"\n📋 Spot Check for Document ID: {doc_id}")
+                logger.info(f"   Before - Usage field present: {before['usage_value'] is not None}")
+                logger.info(f"   After  - Usage field present: {'usage' in updated_doc}")
                 
                 # Verify all fields remain the same except for usage, updatedAt, and updatedBy
                 fields_to_check = ['id', 'type', 'userId', 'conversationId', 'role', 'content', 'feedback', 'createdAt']
@@ -419,7 +566,7 @@ async def run_update(container, dry_run=True, revert=False):
                 
                 for field in fields_to_check:
                     if before[field] != updated_doc.get(field):
-                        print(f"   ❌ MISMATCH - {field}: '{before[field]}' != '{updated_doc.get(field)}'")
+                        logger.error(f"   ❌ MISMATCH - {field}: '{before[field]}' != '{updated_doc.get(field)}'")
                         field_check_passed = False
                         spot_check_passed = False
                 
@@ -427,104 +574,101 @@ async def run_update(container, dry_run=True, revert=False):
                 if revert:
                     # In revert mode, usage field should be removed
                     if 'usage' in updated_doc:
-                        print(f"   ❌ USAGE FIELD NOT REMOVED - Still present after revert")
+                        logger.error(f"   ❌ USAGE FIELD NOT REMOVED - Still present after revert")
                         spot_check_passed = False
                     else:
-                        print(f"   ✅ Usage field correctly removed")
+                        logger.info(f"   ✅ Usage field correctly removed")
                     # Verify updatedAt and updatedBy fields
                     if updated_doc.get('updatedBy') != -1:
-                        print(f"   ❌ UPDATED_BY INCORRECT - Expected: -1, Got: {updated_doc.get('updatedBy')}")
+                        logger.error(f"   ❌ UPDATED_BY INCORRECT - Expected: -1, Got: {updated_doc.get('updatedBy')}")
                         spot_check_passed = False
                     else:
-                        print(f"   ✅ UpdatedBy correctly set to: -1")
+                        logger.info(f"   ✅ UpdatedBy correctly set to: -1")
                 else:
                     # In update mode, check if document already had usage field with values
                     before_usage = before['usage_value']
                     if before_usage is not None:
                         # Document already had usage field - verify values remain unchanged
                         if 'usage' not in updated_doc:
-                            print(f"   ❌ USAGE FIELD LOST - Was present before update but missing after")
+                            logger.error(f"   ❌ USAGE FIELD LOST - Was present before update but missing after")
                             spot_check_passed = False
                         else:
                             after_usage = updated_doc['usage']
                             usage_fields_match = True
                             
                             # Check each usage field
-                            for field in ['completion_tokens', 'prompt_tokens', 'total_tokens']:
+                            for field in USAGE_FIELDS:
                                 before_val = before_usage.get(field)
                                 after_val = after_usage.get(field)
                                 
                                 if before_val != after_val:
-                                    print(f"   ❌ USAGE.{field.upper()} CHANGED - Before: {before_val}, After: {after_val}")
+                                    logger.error(f"   ❌ USAGE.{field.upper()} CHANGED - Before: {before_val}, After: {after_val}")
                                     usage_fields_match = False
                                     spot_check_passed = False
                             
                             if usage_fields_match:
-                                print(f"   ✅ Usage field values remain unchanged")
+                                logger.info(f"   ✅ Usage field values remain unchanged")
                     else:
                         # Document didn't have usage field - should be added with null values
-                        expected_usage = {
-                            'completion_tokens': None,
-                            'prompt_tokens': None,
-                            'total_tokens': None
-                        }
+                        expected_usage = USAGE_NULL
                         if 'usage' not in updated_doc:
-                            print(f"   ❌ USAGE FIELD NOT ADDED - Missing after update")
+                            logger.error(f"   ❌ USAGE FIELD NOT ADDED - Missing after update")
                             spot_check_passed = False
                         elif updated_doc['usage'] != expected_usage:
-                            print(f"   ❌ USAGE FIELD INCORRECT - Expected: {expected_usage}, Got: {updated_doc['usage']}")
+                            logger.error(f"   ❌ USAGE FIELD INCORRECT - Expected: {expected_usage}, Got: {updated_doc['usage']}")
                             spot_check_passed = False
                         else:
-                            print(f"   ✅ Usage field correctly added with null values")
+                            logger.info(f"   ✅ Usage field correctly added with null values")
                 
                     # Verify updatedAt and updatedBy fields
                     if updated_doc.get('updatedBy') != UPDATED_BY:
-                        print(f"   ❌ UPDATED_BY INCORRECT - Expected: {UPDATED_BY}, Got: {updated_doc.get('updatedBy')}")
+                        logger.error(f"   ❌ UPDATED_BY INCORRECT - Expected: {UPDATED_BY}, Got: {updated_doc.get('updatedBy')}")
                         spot_check_passed = False
                     else:
-                        print(f"   ✅ UpdatedBy correctly set to: {UPDATED_BY}")
+                        logger.info(f"   ✅ UpdatedBy correctly set to: {UPDATED_BY}")
                 
                 if field_check_passed:
-                    print(f"   ✅ All other fields remain unchanged")
+                    logger.info(f"   ✅ All other fields remain unchanged")
                 
             except Exception as e:
-                print(f"   ❌ ERROR retrieving updated document {doc_id}: {e}")
+                logger.error(f"   ❌ ERROR retrieving updated document {doc_id}: {e}")
                 spot_check_passed = False
         
-        print(f"\n🔍 SPOT CHECK RESULT: {'✅ PASSED' if spot_check_passed else '❌ FAILED'}")
+        logger.info(f"\n🔍 SPOT CHECK RESULT: {'✅ PASSED' if spot_check_passed else '❌ FAILED'}")
         if not spot_check_passed:
-            print("⚠️  WARNING: Spot check detected issues. Please review the changes carefully.")
+            logger.warning("⚠️  WARNING: Spot check detected issues. Please review the changes carefully.")
         
         # Print summary for actual update
-        print("\n" + "="*60)
+        logger.info("\n" + "="*60)
         if revert:
-            print("📊 REVERT SUMMARY")
-            print("="*60)
-            print(f"✅ Documents reverted: {updated_count}")
-            print(f"⏭️  Documents skipped (already reverted): {skipped_count}")
-            print(f"❌ Documents with errors: {error_count}")
-            print(f"📊 Total processed: {updated_count + skipped_count + error_count}")
+            logger.info("📊 REVERT SUMMARY")
+            logger.info("="*60)
+            logger.info(f"✅ Documents reverted: {updated_count}")
+            logger.info(f"⏭️  Documents skipped (already reverted): {skipped_count}")
+            logger.info(f"❌ Documents with errors: {error_count}")
+            logger.info(f"📊 Total processed: {updated_count + skipped_count + error_count}")
         else:
-            print("📊 UPDATE SUMMARY")
-            print("="*60)
-            print(f"✅ Documents updated: {updated_count}")
-            print(f"⏭️  Documents skipped (already updated): {skipped_count}")
-            print(f"❌ Documents with errors: {error_count}")
-            print(f"📊 Total processed: {updated_count + skipped_count + error_count}")
+            logger.info("📊 UPDATE SUMMARY")
+            logger.info("="*60)
+            logger.info(f"✅ Documents updated: {updated_count}")
+            logger.info(f"⏭️  Documents skipped (already updated): {skipped_count}")
+            logger.info(f"❌ Documents with errors: {error_count}")
+            logger.info(f"📊 Total processed: {updated_count + skipped_count + error_count}")
+        logger.info(f"💰 Request units consumed: {total_request_charge:.2f}")
 
 
 # ===================================================================
 # MAIN EXECUTION LOGIC (reusable for other scripts)
 # ===================================================================
 
-async def main():
+async def main(log_listener=None):
     """Main function to run the update"""
-    print("🚀 CosmosDB Data Update Script")
-    print("="*60)
+    logger.info("🚀 CosmosDB Data Update Script")
+    logger.info("="*60)
     
     # Check for help flag
     if len(sys.argv) > 1 and sys.argv[1] in ['-h', '--help']:
-        print(__doc__)
+        logger.info(__doc__)
         return 0
     
     # Validate environment and get configuration
@@ -537,21 +681,25 @@ async def main():
     revert_mode = False
     if '--revert' in sys.argv:
         revert_mode = True
-        print("🔄 REVERT MODE - Will remove usage fields")
+        logger.info("🔄 REVERT MODE - Will remove usage fields")
     
     # Determine if this is a dry run
     dry_run = True
     if '--execute' in sys.argv or '--run' in sys.argv or '--apply' in sys.argv:
         dry_run = False
         action = "revert changes" if revert_mode else "apply changes"
-        print(f"\n⚠️  LIVE MODE - Will {action}!")
+        logger.warning(f"\n⚠️  LIVE MODE - Will {action}!")
+        if log_listener:
+            # Let queued log output reach the console before prompting
+            log_listener.stop()
+            log_listener.start()
         response = input("Are you sure you want to proceed? (y/N): ")
         if response.lower() != 'y':
-            print("❌ Operation cancelled")
+            logger.info("❌ Operation cancelled")
             return 0
     else:
         mode_text = "revert mode" if revert_mode else "update mode"
-        print(f"\n🔍 Running in DRY RUN {mode_text} (use --execute to apply changes)")
+        logger.info(f"\n🔍 Running in DRY RUN {mode_text} (use --execute to apply changes)")
     
     cosmos_client = None
     try:
@@ -565,18 +713,18 @@ async def main():
         
         if dry_run:
             if revert_mode:
-                print("\n💡 To apply these reverts, run the script with --revert --execute")
-                print("   Example: python pcr-121.py --revert --execute")
+                logger.info("\n💡 To apply these reverts, run the script with --revert --execute")
+                logger.info("   Example: python pcr-121.py --revert --execute")
             else:
-                print("\n💡 To apply these changes, run the script with --execute flag")
-                print("   Example: python pcr-121.py --execute")
+                logger.info("\n💡 To apply these changes, run the script with --execute flag")
+                logger.info("   Example: python pcr-121.py --execute")
         
         return 0
         
     except Exception as e:
-        print(f"❌ Fatal error: {e}")
+        logger.error(f"❌ Fatal error: {e}")
         import traceback
-        print(f"❌ Stack trace: {traceback.format_exc()}")
+        logger.error(f"❌ Stack trace: {traceback.format_exc()}")
         return 1
     
     finally:
@@ -585,16 +733,19 @@ async def main():
             try:
                 await cosmos_client.close()
             except Exception as e:
-                print(f"⚠️  Warning: Error closing connection: {e}")
+                logger.warning(f"⚠️  Warning: Error closing connection: {e}")
 
 
 if __name__ == "__main__":
+    log_listener = start_logging(logger)
     try:
-        exit_code = asyncio.run(main())
-        sys.exit(exit_code)
+        exit_code = asyncio.run(main(log_listener))
     except KeyboardInterrupt:
-        print("\n❌ Operation interrupted by user")
-        sys.exit(1)
+        logger.error("\n❌ Operation interrupted by user")
+        exit_code = 1
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
-        sys.exit(1)
\ No newline at end of file
+        logger.error(f"❌ Unexpected error: {e}")
+        exit_code = 1
+    finally:
+        log_listener.stop()
+    sys.exit(exit_code)
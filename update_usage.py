@@ -4,8 +4,12 @@ Updates 100 message documents by adding a 'usage' field with null values.
 """
 
 import asyncio
+import logging
 from datetime import datetime, timezone
 from azure.cosmos.aio import CosmosClient
+from cosmos_common import CLIENT_OPTIONS, create_transport, patch_in_batches, start_logging
+
+logger = logging.getLogger(__name__)
 
 # CosmosDB Configuration
 # 
@@ -17,86 +21,118 @@ CONTAINER_NAME = "messages"
 # Update configuration
 MAX_RECORDS = 100
 UPDATED_BY = "121"
+BATCH_SIZE = 100  # Operations per transactional batch (Cosmos DB allows at most 100)
+CONCURRENCY = 32  # Batches in flight at once
+QUEUE_SIZE = 64   # Batches buffered between the query and the writers
+MAX_PENDING = 256 # Queried documents held while waiting for their partition's batch to fill
+
+# Patch operations shared by every document; only the updatedAt timestamp is added per run
+USAGE_NULL = {"completion_tokens": None, "prompt_tokens": None, "total_tokens": None}
+ADD_USAGE_OPERATIONS = [
+    {"op": "add", "path": "/usage", "value": USAGE_NULL},
+    {"op": "set", "path": "/updatedBy", "value": UPDATED_BY}
+]
+
+_client = None  # Shared CosmosClient, created on first use
+_client_transport = None  # Transport the shared client was created with
+_client_loop = None  # Event loop the shared client (and its aiohttp session) belongs to
 
 
 def utc_now():
     """Generate current UTC timestamp"""
-    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def get_client(transport=None):
+    """
+    Return the shared CosmosDB client, creating it on first use. The client is tied to
+    the event loop that created it, so call close_client() before that loop ends.
+    """
+    global _client, _client_transport, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None:
+        # Callers can pass their own transport (e.g. wrapping an existing aiohttp session)
+        _client_transport = transport or create_transport()
+        _client = CosmosClient(ENDPOINT, credential=KEY, transport=_client_transport, **CLIENT_OPTIONS)
+        _client_loop = loop
+    elif transport is not None and transport is not _client_transport:
+        raise ValueError("The shared client already uses another transport - call close_client() first")
+    elif loop is not _client_loop:
+        raise RuntimeError("The shared client belongs to another event loop - call close_client() before it ends")
+    return _client
+
 
+async def close_client():
+    """Close the shared CosmosDB client and its connections"""
+    global _client, _client_transport, _client_loop
+    if _client is not None:
+        await _client.close()
+        _client = None
+        _client_transport = None
+        _client_loop = None
 
-async def main():
+
+async def main(keep_client=False):
     """Main function to update CosmosDB documents"""
-    print("🚀 Starting CosmosDB Update")
-    print(f"📦 Database: {DATABASE_NAME}")
-    print(f"📦 Container: {CONTAINER_NAME}")
-    print(f"📊 Max records to update: {MAX_RECORDS}\n")
+    logger.info("🚀 Starting CosmosDB Update")
+    logger.info(f"📦 Database: {DATABASE_NAME}")
+    logger.info(f"📦 Container: {CONTAINER_NAME}")
+    logger.info(f"📊 Max records to update: {MAX_RECORDS}\n")
     
-    # Initialize CosmosDB client
-    client = CosmosClient(ENDPOINT, credential=KEY)
-    database = client.get_database_client(DATABASE_NAME)
+    # Reuse the shared client so repeated runs skip connection and account setup
+    database = get_client().get_database_client(DATABASE_NAME)
     container = database.get_container_client(CONTAINER_NAME)
     
     try:
-        # Use a simpler query with TOP to limit results and avoid header issues
-        # Query in very small batches to work around header size limitation
-        query = "SELECT TOP 1 c.id FROM c WHERE c.type = 'message' AND c.role = 'assistant' AND NOT IS_DEFINED(c.usage)"
+        # Assistant messages that don't have the usage field yet
+        condition = "c.type = @type AND c.role = @role AND NOT IS_DEFINED(c.usage)"
+        parameters = [
+            {"name": "@type", "value": "message"},
+            {"name": "@role", "value": "assistant"}
+        ]
+        
+        # Usage field with null values plus update metadata, the same for every document
+        patch_operations = ADD_USAGE_OPERATIONS + [{"op": "set", "path": "/updatedAt", "value": utc_now()}]
         
-        print("🔍 Querying and updating documents in small batches...")
+        logger.info("🔍 Querying and updating documents...")
         
-        updated_count = 0
-        processed_ids = set()
+        stats = await patch_in_batches(
+            container,
+            condition,
+            parameters,
+            patch_operations,
+            MAX_RECORDS,
+            batch_size=BATCH_SIZE,
+            concurrency=CONCURRENCY,
+            queue_size=QUEUE_SIZE,
+            max_pending=MAX_PENDING,
+            progress_label="Updated"
+        )
         
-        # Process documents in a loop, querying one at a time
-        for batch_num in range(MAX_RECORDS):
-            try:
-                # Query for one document ID at a time
-                items = []
-                async for item in container.query_items(query=query, max_item_count=1):
-                    if item['id'] not in processed_ids:
-                        items.append(item)
-                        processed_ids.add(item['id'])
-                        break
-                
-                if not items:
-                    print(f"\n✅ No more documents to update!")
-                    break
-                
-                doc_id = items[0]['id']
-                
-                # Read the full document (use id as partition key if not specified)
-                doc = await container.read_item(item=doc_id, partition_key=doc_id)
-                
-                # Add usage field with null values
-                doc['usage'] = {
-                    'completion_tokens': None,
-                    'prompt_tokens': None,
-                    'total_tokens': None
-                }
-                doc['updatedAt'] = utc_now()
-                doc['updatedBy'] = UPDATED_BY
-                
-                # Save document
-                await container.upsert_item(doc)
-                updated_count += 1
-                
-                if updated_count % 10 == 0:
-                    print(f"✅ Updated {updated_count} documents...")
-                
-            except Exception as e:
-                print(f"❌ Error in batch {batch_num + 1}: {e}")
-                # Continue with next document
-                continue
+        if not stats.found:
+            logger.info(f"\n✅ No more documents to update!")
+            return
         
-        print(f"\n🎉 Update Complete!")
-        print(f"✅ Successfully updated: {updated_count} documents")
+        logger.info(f"\n📋 Found {stats.found} documents")
+        logger.info(f"\n🎉 Update Complete!")
+        logger.info(f"✅ Successfully updated: {stats.written} documents")
+        logger.info(f"⚠️  Skipped: {stats.skipped} documents")
+        logger.info(f"❌ Failed: {stats.failed} documents")
+        logger.info(f"💰 Request units consumed: {stats.request_charge:.2f}")
 
         
     except Exception as e:
-        print(f"❌ Error: {e}")
-    
+        logger.error(f"❌ Error: {e}")
     finally:
-        await client.close()
+        # Only keep the shared client open when the caller runs again in this event loop
+        if not keep_client:
+            await close_client()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    log_listener = start_logging(logger)
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
+